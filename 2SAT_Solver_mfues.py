@@ -2,6 +2,8 @@
 
 import time
 import copy
+from itertools import chain
+import numpy as np
 import matplotlib.pyplot as plt
 
 def set_assignment(lit, assignments):
@@ -187,6 +189,227 @@ def test_wff(wff,Nvars,Nclauses):
     exec_time=int((end-start)*1e6) # get total time passed in microseconds
     return [wff, assignment,SatFlag,exec_time]
 
+def build_implication_batch(wffs, nvarlist):
+    '''
+    Packs many 2-SAT wffs into one implication graph so they can all be worked on with array operations.
+    Literal v of wff i is node offsets[i] + 2*(v-1) and its negation -v is the node right after it,
+    so flipping the last bit of a node negates it.
+    Each clause [a, b] adds the implications -a -> b and -b -> a, and a unit clause [a] is treated as [a, a].
+    A wff with an empty clause is marked Unsatisfiable, the same as in DPLL.
+    Returns the arrays of edge sources and destinations, the node offset of each wff, and the Unsatisfiable flags.
+    '''
+    nwffs = len(wffs)
+    nvars = np.array(nvarlist, dtype=np.int64)
+    offsets = np.zeros(nwffs+1, dtype=np.int64)
+    np.cumsum(2*nvars, out=offsets[1:])
+    unsat = np.zeros(nwffs, dtype=bool)
+
+    # flatten every clause of every wff into one array of literals, remembering how long each clause is
+    nclauses = np.fromiter(map(len, wffs), dtype=np.int64, count=nwffs)
+    clauses = list(chain.from_iterable(wffs))
+    lengths = np.fromiter(map(len, clauses), dtype=np.int64, count=len(clauses))
+    if (lengths > 2).any():
+        raise ValueError('batch_solve only solves 2-SAT wffs, but a clause has more than two literals')
+    lits = np.fromiter(chain.from_iterable(clauses), dtype=np.int64, count=int(lengths.sum()))
+    owner = np.repeat(np.arange(nwffs), nclauses)
+    ends = np.cumsum(lengths)
+    # an empty clause can never be True, so its wff is Unsatisfiable and the clause adds no edges
+    empty = lengths == 0
+    if empty.any():
+        unsat[owner[empty]] = True
+        owner, ends, lengths = owner[~empty], ends[~empty], lengths[~empty]
+
+    # the first and last literal of each clause are the same literal for a unit clause
+    first = lits[ends-lengths]
+    last = lits[ends-1]
+    first = offsets[owner] + 2*(np.abs(first)-1) + (first < 0)
+    last = offsets[owner] + 2*(np.abs(last)-1) + (last < 0)
+    # clause [a, b] gives the edges -a -> b and -b -> a
+    src = np.concatenate((first ^ 1, last ^ 1))
+    dst = np.concatenate((last, first))
+    # a clause like [a, -a] only gives edges from a node to itself, which never change the answer
+    keep = src != dst
+    return src[keep], dst[keep], offsets, unsat
+
+def peel_sources(src, dst, nnodes):
+    '''
+    Repeatedly removes every node of the implication graph with no edges coming into it (Kahn's topological sort),
+    one round at a time for every wff at once. Each edge is only looked at once, when its source is removed.
+    Removed nodes can't be part of a cycle, so each one is its own strongly connected component.
+    Returns the round each node was removed in, or -1 for nodes that are never removed.
+    '''
+    # sort the edges by source so the edges leaving a node are next to each other
+    dst = dst[np.argsort(src)]
+    outdeg = np.bincount(src, minlength=nnodes)
+    first_edge = np.cumsum(outdeg) - outdeg
+    indeg = np.bincount(dst, minlength=nnodes)
+
+    rounds = np.full(nnodes, -1, dtype=np.int64)
+    removed = np.flatnonzero(indeg == 0)
+    rounds[removed] = 0
+    r = 0
+    while len(removed):
+        r += 1
+        # find every edge leaving a node removed in the last round
+        deg = outdeg[removed]
+        ends = np.cumsum(deg)
+        if ends[-1] == 0:
+            break
+        targets = dst[np.repeat(first_edge[removed] - ends + deg, deg) + np.arange(ends[-1])]
+        # take those edges away and remove any node left with no edges coming into it
+        np.subtract.at(indeg, targets, 1)
+        removed = np.sort(targets[indeg[targets] == 0])
+        # a node can lose its last edges from several removed nodes at once, so drop the repeats
+        first = np.ones(len(removed), dtype=bool)
+        first[1:] = removed[1:] != removed[:-1]
+        removed = removed[first]
+        rounds[removed] = r
+    return rounds
+
+def batch_closure(reach):
+    '''
+    Computes the transitive closure of every implication graph in the batch at once using Warshall's algorithm.
+    reach has shape (number of nodes, number of 64-bit words per row, number of wffs), and bit j of row i
+    is set if node i reaches node j. The wffs are the last axis so each step runs over the whole batch together.
+    For each node k, every row that reaches k gets all of row k's bits added to it.
+    The reach array is altered in place and returned.
+    '''
+    nnodes = reach.shape[0]
+    # reuse the same work arrays for every step instead of allocating new ones
+    hits = np.empty((nnodes, reach.shape[2]), dtype=np.uint64)
+    update = np.empty_like(reach)
+    for k in range(nnodes):
+        # find the rows that reach node k in every wff of the batch
+        np.right_shift(reach[:, k // 64, :], np.uint64(k % 64), out=hits)
+        hits &= np.uint64(1)
+        # turn each hit into a mask of all ones so it can select row k with a bitwise and
+        np.negative(hits, out=hits)
+        np.bitwise_and(hits[:, None, :], reach[k], out=update)
+        reach |= update
+    return reach
+
+def order_core(reach):
+    '''
+    Reads the results for one bucket of wffs out of the closure of their cores (see batch_closure).
+    A wff is Unsatisfiable exactly when some variable's two literals reach each other.
+    Nodes are ordered by how many nodes they reach, and nodes reaching the same number are grouped by the
+    smallest node of their strongly connected component. Everything is computed on the packed 64-bit words.
+    Returns the Unsatisfiable flag of each wff and, for each wff and node, the number of nodes it reaches
+    and the smallest node in its component.
+    '''
+    nnodes, nwords, _ = reach.shape
+    reach = reach.transpose(2, 0, 1) # shape (wffs, nodes, words)
+    one = np.uint64(1)
+
+    # node 2*j reaching node 2*j+1 and node 2*j+1 reaching node 2*j makes the wff Unsatisfiable
+    nodes = np.arange(nnodes)
+    negation = nodes ^ 1
+    reaches_negation = (reach[:, nodes, negation // 64] >> (negation % 64).astype(np.uint64)) & one
+    unsat = (reaches_negation[:, 0::2] & reaches_negation[:, 1::2]).any(axis=1)
+
+    counts = np.bitwise_count(reach).sum(axis=2, dtype=np.int64)
+
+    # a node w reaches v exactly when -v reaches -w, so the row of -v with each pair of bits swapped
+    # gives every node that reaches v
+    pairs = np.uint64(0x5555555555555555)
+    rows = reach.reshape(reach.shape[0], nnodes // 2, 2, nwords)[:, :, ::-1].reshape(reach.shape)
+    reached_by = ((rows & pairs) << one) | ((rows >> one) & pairs)
+    # the nodes in v's component both reach v and are reached by v
+    component = reach & reached_by
+    # find the smallest node in the component from the lowest set bit of each word
+    lowest = np.bitwise_count((component & np.negative(component)) - one).astype(np.int64) + 64*np.arange(nwords)
+    lowest[component == 0] = 64*nwords
+    return unsat, counts, lowest.min(axis=2)
+
+def solve_chunk(wffs, nvarlist):
+    '''
+    Solves one chunk of wffs for batch_solve. Returns a list of [SatFlag, assignment] for each wff.
+    '''
+    src, dst, offsets, unsat = build_implication_batch(wffs, nvarlist)
+    nnodes = int(offsets[-1])
+    nvars = np.array(nvarlist, dtype=np.int64)
+    owner = np.repeat(np.arange(len(wffs)), 2*nvars)
+    local = np.arange(nnodes) - offsets[owner]
+
+    # nodes with nothing coming in are removed by peel_sources, and by symmetry their negations are
+    # exactly the nodes with nothing going out, so they are ordered from the same rounds
+    rounds = peel_sources(src, dst, nnodes)
+    neg_rounds = rounds.reshape(-1, 2)[:, ::-1].ravel()
+    # each node gets a key that grows along every edge and is the same only within a component:
+    # removed nodes come first by round, nodes whose negation was removed come last by reverse round,
+    # and the rest (the core) go in between ordered from the closure of the core
+    span = int(2*nvars.max()) + 2
+    key = np.where(rounds >= 0, rounds*span + local, 2*span*span + (span-1-neg_rounds)*span + local)
+
+    # only the core can contain cycles, so the closure is only computed on the core of each wff
+    core = (rounds < 0) & (neg_rounds < 0)
+    core_nodes = np.flatnonzero(core)
+    core_owner = owner[core_nodes]
+    core_size = np.bincount(core_owner, minlength=len(wffs))
+    core_local = np.arange(len(core_nodes)) - (np.cumsum(core_size) - core_size)[core_owner]
+    core_id = np.zeros(nnodes, dtype=np.int64)
+    core_id[core_nodes] = core_local
+    core_edge = core[src] & core[dst]
+    core_src = core_id[src[core_edge]]
+    core_dst = core_id[dst[core_edge]]
+    core_edge_owner = owner[src[core_edge]]
+
+    # group the wffs into buckets of similar core size so small cores are not padded to the size of the largest
+    with_core = np.flatnonzero(core_size)
+    buckets = (core_size[with_core] + 31) // 32
+    position = np.zeros(len(wffs), dtype=np.int64)
+    for bucket in np.unique(buckets):
+        members = with_core[buckets == bucket]
+        position[members] = np.arange(len(members))
+        in_bucket = np.zeros(len(wffs), dtype=bool)
+        in_bucket[members] = True
+        size = int(core_size[members].max())
+        reach = np.zeros((size, (size + 63) // 64, len(members)), dtype=np.uint64)
+
+        # every node reaches itself, and each edge sets one bit
+        nodes = in_bucket[core_owner]
+        ids = core_local[nodes]
+        where = position[core_owner[nodes]]
+        reach[ids, ids // 64, where] = np.left_shift(np.uint64(1), (ids % 64).astype(np.uint64))
+        edges = in_bucket[core_edge_owner]
+        ids = core_dst[edges]
+        np.bitwise_or.at(reach, (core_src[edges], ids // 64, position[core_edge_owner[edges]]),
+                         np.left_shift(np.uint64(1), (ids % 64).astype(np.uint64)))
+
+        bucket_unsat, counts, component = order_core(batch_closure(reach))
+        unsat[members[bucket_unsat]] = True
+        # reaching more nodes means coming earlier in the order
+        ids = core_local[nodes]
+        key[core_nodes[nodes]] = span*span + (span-1-counts[where, ids])*span + component[where, ids]
+
+    # a variable is True if its positive literal comes after its negation in the order
+    values = (key[0::2] > key[1::2]).astype(np.int64).tolist()
+    results = []
+    var_offsets = (offsets[:-1] // 2).tolist()
+    for i, flag in enumerate(unsat.tolist()):
+        if flag:
+            results.append([False, []])
+        else:
+            results.append([True, values[var_offsets[i]:var_offsets[i]+nvarlist[i]]])
+    return results
+
+def batch_solve(wffs, nvarlist, batch_size=512):
+    '''
+    Solves a list of small 2-SAT wffs together with array operations instead of one at a time with DPLL.
+    The wffs are split into chunks of at most batch_size wffs to bound the memory used.
+    In each chunk, peel_sources first removes every node of the implication graphs that can't be on a cycle,
+    then batch_closure finds which nodes reach which on the small core that is left.
+    A wff is Unsatisfiable exactly when some variable's two literals reach each other. Otherwise the nodes are put
+    in an order that follows every implication, and a variable is set True if its positive literal comes after its
+    negation in that order.
+    Returns a list of [SatFlag, assignment] for each wff. The assignment is a list of 0s and 1s with variable 1
+    at index 0, the same as the Assignment list in DumbSAT, or an empty list if the wff is Unsatisfiable.
+    '''
+    results = []
+    for start in range(0, len(wffs), batch_size):
+        results += solve_chunk(wffs[start:start+batch_size], nvarlist[start:start+batch_size])
+    return results
+
 def convert_to_int(data):
     '''
     Recursively converts all the literals in the input from strings to integers to be used to solve the wff.
@@ -369,8 +592,33 @@ def trace_execution(file_name):
     # close the output file
     f1.close()
 
+def batch_execution(file_name):
+    '''
+    Solves every wff in the input data file in one batch using batch_solve instead of one at a time with test_wff.
+    Prints whether each wff is Unsatisfiable (U) or Satisfiable (S) and the assignments if Satisfiable,
+    in the same format as test_execution, followed by the total time and the number of wffs solved per second.
+    '''
+    # generate the wffs from the input data file
+    Nvars, Nclauses, wffs = build_wff(file_name)
+    start = time.time() # start timer
+    results = batch_solve(wffs, Nvars) # solve all the wffs together
+    end = time.time() # end timer
+    for i in range(len(wffs)):
+        SatFlag, Assignment = results[i]
+        # generate string to print
+        if SatFlag:
+            y='S' # the wff is Satisfiable
+            for k in range(Nvars[i]):
+                y=y+','+str(Assignment[k])
+        else:
+            y='U' # the wff is Unsatisfiable
+        print(y)
+    exec_time=int((end-start)*1e6) # get total time passed in microseconds
+    print('Solved '+str(len(wffs))+' wffs in '+str(exec_time)+' us ('+str(int(len(wffs)/max(end-start, 1e-9)))+' wffs per second)')
+
 
 #test_execution("check_2SAT_input_mfues.csv")
 trace_execution("check_2SAT_input_mfues.csv")
 #test_execution("data_generated_2SAT_mfues.csv")
-#generate_scatter_plot("data_generated_2SAT_mfues.csv")
\ No newline at end of file
+#generate_scatter_plot("data_generated_2SAT_mfues.csv")
+#batch_execution("data_generated_large_2SAT_mfues.csv")
\ No newline at end of file